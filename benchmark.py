@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Any
+
+from cassette import REPLAY, Cassette
+from fake_servers import (FAKE_BOT_ID, FAKE_BOT_USERNAME, FakeOpenAIServer,
+                          FakeTelegramServer)
+
+logger = logging.getLogger(__name__)
+
+# Токен, с которым бот ходит в фейковый Bot API
+FAKE_BOT_TOKEN = '123456:FAKE-BENCHMARK-TOKEN'
+
+# Сценарий одного пользователя, проходящий через все режимы бота
+SCENARIO: list[tuple[str, str]] = [
+    ('command', '/start'),
+    ('callback', 'random_fact'),
+    ('callback', 'main_menu'),
+    ('command', '/random'),
+    ('callback', 'random_fact'),
+    ('callback', 'main_menu'),
+    ('command', '/gpt'),
+    ('text', 'Как работает асинхронность в Python?'),
+    ('callback', 'main_menu'),
+    ('command', '/talk'),
+    ('callback', 'Hawking'),
+    ('text', 'Что такое чёрная дыра?'),
+    ('callback', 'change_person'),
+    ('callback', 'Tolkien'),
+    ('text', 'Расскажите о Средиземье'),
+    ('callback', 'main_menu'),
+    ('command', '/quiz'),
+    ('callback', 'quiz_prog'),
+    ('text', 'Ответ: список'),
+    ('callback', 'quiz_more'),
+    ('text', 'Ответ: словарь'),
+    ('callback', 'change_quiz_topic'),
+    ('callback', 'quiz_math'),
+    ('callback', 'main_menu'),
+    ('command', '/new_word'),
+    ('callback', 'new_word'),
+    ('callback', 'main_menu'),
+]
+
+
+class UpdateFactory:
+    """Собирает JSON апдейтов Bot API для синтетических пользователей."""
+
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+
+    def make(self, user_id: int, kind: str, value: str) -> dict[str, Any]:
+        """
+        Создаёт апдейт заданного типа от пользователя.
+
+        Args:
+            user_id (int): Идентификатор пользователя (и чата).
+            kind (str): 'command', 'text' или 'callback'.
+            value (str): Текст сообщения или callback_data.
+
+        Returns:
+            dict[str, Any]: Апдейт в формате Bot API.
+        """
+        update_id: int = next(self._ids)
+        user: dict[str, Any] = {'id': user_id, 'is_bot': False,
+                                'first_name': f'User{user_id}'}
+        chat: dict[str, Any] = {'id': user_id, 'type': 'private'}
+        if kind == 'callback':
+            return {'update_id': update_id, 'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': value,
+                'message': {
+                    'message_id': update_id, 'date': int(time.time()),
+                    'chat': chat, 'text': '',
+                    'from': {'id': FAKE_BOT_ID, 'is_bot': True,
+                             'first_name': 'Fake',
+                             'username': FAKE_BOT_USERNAME},
+                },
+            }}
+        message: dict[str, Any] = {
+            'message_id': update_id, 'date': int(time.time()),
+            'chat': chat, 'from': user, 'text': value,
+        }
+        if kind == 'command':
+            message['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len(value)}]
+        return {'update_id': update_id, 'message': message}
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """
+    Возвращает перцентиль выборки.
+
+    Args:
+        values (list[float]): Выборка.
+        percent (int): Номер перцентиля (1-99).
+
+    Returns:
+        float: Значение перцентиля или 0 для пустой выборки.
+    """
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[
+        percent - 1]
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    """
+    Прогоняет сценарий всех пользователей через conv_handler бота.
+
+    Args:
+        args (argparse.Namespace): Параметры запуска.
+
+    Returns:
+        dict[str, Any]: Сводка результатов.
+    """
+    tmp = tempfile.TemporaryDirectory(prefix='benchmark-')
+    workdir: str = tmp.name
+    telegram = FakeTelegramServer(
+        latency=args.tg_latency_ms / 1000, error_rate=args.tg_error_rate,
+        seed=args.seed).start()
+    cassette: Cassette | None = None
+    if args.cassette:
+        cassette = Cassette(args.cassette, mode=REPLAY,
+                            speed=args.cassette_speed, strict=False)
+    openai = FakeOpenAIServer(
+        latency=args.llm_latency_ms / 1000, error_rate=args.llm_error_rate,
+        token_rate=args.llm_token_rate, completion_tokens=args.llm_tokens,
+        seed=args.seed, cassette=cassette).start()
+    try:
+        os.environ.update({
+            'ChatGPT_TOKEN': 'sk-fake',
+            'OPENAI_BASE_URL': f'{openai.url}/v1',
+            'OPENAI_PROXY': '',
+            'MENU_CACHE_FILE': os.path.join(workdir, 'menu_cache.jsonl'),
+            'CONTENT_DIR': (args.content_dir
+                            or os.path.join(workdir, 'content')),
+        })
+        bot = importlib.import_module('bot')
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        if args.concurrency > 1:
+            logger.warning(
+                'История ChatGptService общая для всех чатов: при '
+                '--concurrency %s пользователи портят историю друг друга, '
+                'а бот работает с concurrent_updates=1. Результат не '
+                'соответствует боту.', args.concurrency)
+
+        from telegram import Update
+        from telegram.ext import ApplicationBuilder, TypeHandler
+
+        from sessions import CONTEXT_TYPES, SessionSweeper
+
+        app = (ApplicationBuilder()
+               .token(FAKE_BOT_TOKEN)
+               .context_types(CONTEXT_TYPES)
+               .base_url(f'{telegram.url}/bot')
+               .updater(None)
+               .concurrent_updates(args.concurrency)
+               .connection_pool_size(args.pool_size)
+               .build())
+        pending: dict[int, asyncio.Future] = {}
+        errors: list[str] = []
+
+        async def mark_done(update: Update, context: Any) -> None:
+            future = pending.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+        async def on_error(update: Any, context: Any) -> None:
+            errors.append(type(context.error).__name__)
+
+        sweeper: SessionSweeper | None = None
+        if args.session_ttl is not None:
+            sweeper = SessionSweeper(
+                os.path.join(workdir, 'sessions'), args.session_ttl,
+                interval=max(args.session_ttl / 2, 0.1),
+                menu_cache=bot.menu_cache)
+            sweeper.register(app, bot.conv_handler)
+        app.add_handler(bot.conv_handler)
+        app.add_handler(TypeHandler(Update, mark_done), group=1)
+        app.add_error_handler(on_error)
+
+        factory = UpdateFactory()
+        latencies: list[float] = []
+        loop = asyncio.get_running_loop()
+
+        async def run_user(user_id: int) -> None:
+            for _ in range(args.rounds):
+                for kind, value in SCENARIO:
+                    data: dict[str, Any] = factory.make(user_id, kind, value)
+                    future: asyncio.Future = loop.create_future()
+                    pending[data['update_id']] = future
+                    start: float = time.perf_counter()
+                    await app.update_queue.put(Update.de_json(data, app.bot))
+                    await future
+                    latencies.append(time.perf_counter() - start)
+
+        async with app:
+            await bot.warm_up()
+            telegram.reset()
+            openai.reset()
+            await app.start()
+            if sweeper is not None:
+                await sweeper.post_init(app)
+            started: float = time.perf_counter()
+            await asyncio.gather(*(run_user(1_000_000 + user)
+                                   for user in range(args.users)))
+            elapsed: float = time.perf_counter() - started
+            sessions: int = len(app.user_data)
+            conversations: int = bot.conv_handler.resident
+            if sweeper is not None:
+                await sweeper.post_stop(app)
+            await app.stop()
+
+    finally:
+        telegram.stop()
+        openai.stop()
+        tmp.cleanup()
+    updates: int = len(latencies)
+    return {
+        'users': args.users,
+        'updates': updates,
+        'sessions_resident': sessions,
+        'conversations_resident': conversations,
+        'errors': len(errors),
+        'error_types': dict(sorted(
+            (name, errors.count(name)) for name in set(errors))),
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(updates / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(percentile(latencies, percent) * 1000, 2)
+            for name, percent in (('p50', 50), ('p95', 95), ('p99', 99))},
+        'telegram_calls_per_update': round(
+            sum(telegram.calls.values()) / updates, 2),
+        'openai_calls_per_update': round(
+            sum(openai.calls.values()) / updates, 2),
+        'telegram_calls': dict(telegram.calls),
+        'openai_calls': dict(openai.calls),
+    }
+
+
+def print_report(result: dict[str, Any]) -> None:
+    """
+    Печатает сводку результатов в консоль.
+
+    Args:
+        result (dict[str, Any]): Результат run_benchmark().
+    """
+    latency: dict[str, float] = result['latency_ms']
+    print(f"Пользователей: {result['users']}, "
+          f"апдейтов: {result['updates']}, ошибок: {result['errors']} "
+          f"{result['error_types'] or ''}")
+    print(f"Сессий в памяти в конце: {result['sessions_resident']}")
+    print('Состояний диалогов в памяти в конце: '
+          f"{result['conversations_resident']}")
+    print(f"Время: {result['seconds']} с, "
+          f"апдейтов в секунду: {result['updates_per_sec']}")
+    print(f"Задержка, мс: p50={latency['p50']} p95={latency['p95']} "
+          f"p99={latency['p99']}")
+    print(f"Вызовов Bot API на апдейт: "
+          f"{result['telegram_calls_per_update']} {result['telegram_calls']}")
+    print(f"Вызовов OpenAI на апдейт: "
+          f"{result['openai_calls_per_update']} {result['openai_calls']}")
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест бота на фейковых Bot API и OpenAI.')
+    parser.add_argument('--users', type=int, default=10,
+                        help='число одновременных пользователей')
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='сколько раз каждый пользователь проходит '
+                             'сценарий')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent_updates приложения; пока история '
+                             'модели общая для всех чатов, бот работает '
+                             'только с 1')
+    parser.add_argument('--pool-size', type=int, default=1,
+                        help='размер пула соединений к Bot API')
+    parser.add_argument('--tg-latency-ms', type=float, default=20,
+                        help='задержка ответа Bot API')
+    parser.add_argument('--tg-error-rate', type=float, default=0.0,
+                        help='доля ошибочных ответов Bot API')
+    parser.add_argument('--llm-latency-ms', type=float, default=300,
+                        help='задержка до первого токена модели')
+    parser.add_argument('--llm-token-rate', type=float, default=0.0,
+                        help='скорость генерации, токенов в секунду')
+    parser.add_argument('--llm-tokens', type=int, default=50,
+                        help='число токенов в ответе модели')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0,
+                        help='доля ошибочных ответов модели')
+    parser.add_argument('--session-ttl', type=float, default=None,
+                        help='вытеснять сессии, неактивные дольше TTL '
+                             'секунд')
+    parser.add_argument('--content-dir', metavar='PATH',
+                        help='каталог пулов pregenerate.py (по умолчанию '
+                             'пулы пусты)')
+    parser.add_argument('--cassette', metavar='PATH',
+                        help='брать ответы модели и их задержки из кассеты')
+    parser.add_argument('--cassette-speed', type=float, default=1.0,
+                        help='множитель задержек из кассеты')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed для инъекции ошибок')
+    parser.add_argument('--json', metavar='PATH',
+                        help='сохранить результат в JSON-файл')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    arguments = parse_args()
+    report: dict[str, Any] = asyncio.run(run_benchmark(arguments))
+    print_report(report)
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
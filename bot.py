@@ -3,8 +3,8 @@ import os
 
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import (ApplicationBuilder, CallbackQueryHandler,
-                          CommandHandler, ContextTypes, ConversationHandler,
+from telegram.ext import (Application, ApplicationBuilder,
+                          CallbackQueryHandler, CommandHandler, ContextTypes,
                           MessageHandler, filters)
 
 from constants import (BUTTON_TEXTS, CALLBACK_CHANGE_PERSON,
@@ -19,9 +19,16 @@ from constants import (BUTTON_TEXTS, CALLBACK_CHANGE_PERSON,
                        RANDOM_MORE, RETURN_TO_MAIN, SELECT_PERSON,
                        SELECT_QUIZ_TOPIC, START_MESSAGE, TALK, TALK_MESSAGE,
                        TRANSLATE_PERSONS, TRANSLATE_QUIZ_TOPICS)
+from content_store import ContentStore
 from gpt import ChatGptService
-from util import (load_message, load_prompt, send_html, send_image,
-                  send_response, send_text, send_text_buttons, show_main_menu)
+from lifecycle import Lifecycle
+from metrics import start_metrics_server, track_handler
+from sessions import (CONTEXT_TYPES, SessionConversationHandler,
+                      SessionSweeper)
+from tracing import configure_tracing
+from util import (edit_text, load_message, load_prompt, menu_cache, send_html,
+                  send_image, send_response, send_text, send_text_buttons,
+                  show_main_menu, warm_resources)
 
 load_dotenv()
 
@@ -32,30 +39,89 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
+METRICS_PORT = os.environ.get('METRICS_PORT', '')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+TRACE_SLOW_MS = os.environ.get('TRACE_SLOW_MS')
+SESSION_DIR = os.environ.get('SESSION_DIR', 'sessions')
+SESSION_TTL = float(os.environ.get('SESSION_TTL', '1800'))
+CONTENT_DIR = os.environ.get('CONTENT_DIR', 'resources/content')
+CHECKPOINT_FILE = os.environ.get('CHECKPOINT_FILE', 'checkpoint.jsonl')
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', '20'))
 chat_gpt: ChatGptService = ChatGptService.get_instance()
+content_store = ContentStore(CONTENT_DIR)
+sweeper = SessionSweeper(SESSION_DIR, SESSION_TTL, menu_cache=menu_cache)
+lifecycle = Lifecycle(CHECKPOINT_FILE, DRAIN_TIMEOUT)
 
 
+async def warm_up() -> None:
+    """Загружает ресурсы и пулы контента, открывает соединение с OpenAI."""
+    resources: int = warm_resources()
+    content_store.load()
+    await chat_gpt.warm_up()
+    logger.info('Прогрев завершён: файлов ресурсов %s, пулы %s',
+                resources, content_store.sizes())
+
+
+async def post_init(application: Application) -> None:
+    """Прогревает бота до начала получения апдейтов."""
+    await warm_up()
+    await sweeper.post_init(application)
+    await lifecycle.post_init(application)
+
+
+async def post_stop(application: Application) -> None:
+    """Сохраняет состояние бота после остановки."""
+    await sweeper.post_stop(application)
+    chat_gpt.close()
+
+
+async def ask_quiz_question(topic: str, message_text: str) -> str:
+    """
+    Возвращает вопрос квиза из пула заранее сгенерированных вопросов,
+    а если пул пуст - запрашивает его у модели.
+
+    Args:
+        topic (str): Тема квиза (имя пула).
+        message_text (str): Сообщение для модели.
+
+    Returns:
+        str: Текст вопроса.
+    """
+    question: str | None = content_store.choice(topic)
+    if question is None:
+        return await chat_gpt.add_message(message_text)
+    chat_gpt.add_exchange(message_text, question)
+    return question
+
+
+async def send_start_menu(
+        update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отправляет приветствие и показывает главное меню."""
+    text: str = load_message(START_MESSAGE)
+    await send_response(update, context, START_MESSAGE, text)
+    await show_main_menu(update, context, MAIN_MENU_BUTTONS)
+
+
+@track_handler(START_MESSAGE)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает команду /start и показывает главное меню."""
     logger.info('Старт команды /start от пользователя %s',
                 update.effective_user.id)
-    text: str = load_message(START_MESSAGE)
-    await send_response(update, context, START_MESSAGE, text)
-    await show_main_menu(update, context, MAIN_MENU_BUTTONS)
+    await send_start_menu(update, context)
     return MAIN
 
 
-async def random(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def send_random_fact(
+        update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет пользователю рандомный факт."""
-    logger.info('Запрос на рандомный факт от пользователя %s',
-                update.effective_user.id)
     prompt: str = load_prompt(RANDOM_MESSAGE)
     message = load_message(RANDOM_MESSAGE)
     message = await send_response(update, context, RANDOM_MESSAGE, message)
 
     try:
-        answer: str = await chat_gpt.send_question(prompt, '')
-        await message.edit_text(answer)
+        answer: str = (content_store.choice(RANDOM_MESSAGE)
+                       or await chat_gpt.send_question(prompt, ''))
+        await edit_text(message, answer)
         buttons: dict[str, str] = {
             'random_fact': BUTTON_TEXTS['random_fact'],
             'main_menu': BUTTON_TEXTS['main_menu']
@@ -65,20 +131,30 @@ async def random(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                     update.effective_user.id)
     except Exception as e:
         logger.error('Ошибка при получении рандомного факта: %s', str(e))
-        await message.edit_text(ERROR_MESSAGE.format(error=str(e)))
+        await edit_text(message, ERROR_MESSAGE.format(error=str(e)))
+
+
+@track_handler(RANDOM_MESSAGE)
+async def random(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Отправляет пользователю рандомный факт."""
+    logger.info('Запрос на рандомный факт от пользователя %s',
+                update.effective_user.id)
+    await send_random_fact(update, context)
     return RANDOM
 
 
+@track_handler(RANDOM_MESSAGE)
 async def random_fact(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает запрос на получение еще одного рандомного факта."""
     logger.info('Пользователь %s запрашивает еще рандомный факт',
                 update.effective_user.id)
     await update.callback_query.answer()
-    await random(update, context)
+    await send_random_fact(update, context)
     return RANDOM
 
 
+@track_handler(GPT_MESSAGE)
 async def gpt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает команду /gpt и начинает диалог с ChatGPT."""
     logger.info('Пользователь %s вызвал команду /gpt',
@@ -90,6 +166,7 @@ async def gpt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return GPT
 
 
+@track_handler(GPT_MESSAGE)
 async def gpt_dialog(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает сообщения от пользователя в режиме GPT."""
@@ -100,14 +177,14 @@ async def gpt_dialog(
 
     try:
         answer: str = await chat_gpt.add_message(text)
-        await message.edit_text(answer)
+        await edit_text(message, answer)
         buttons: dict[str, str] = {'main_menu': BUTTON_TEXTS['main_menu']}
         await send_text_buttons(update, context, RETURN_TO_MAIN, buttons)
         logger.info('Ответ от ChatGPT отправлен пользователю %s',
                     update.effective_user.id)
     except Exception as e:
         logger.error('Ошибка при обработке сообщения GPT: %s', str(e))
-        await message.edit_text(ERROR_MESSAGE.format(error=str(e)))
+        await edit_text(message, ERROR_MESSAGE.format(error=str(e)))
     return GPT
 
 
@@ -124,12 +201,13 @@ async def show_persons(
     return TALK
 
 
+@track_handler(TALK_MESSAGE)
 async def select_person(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает выбор личности пользователем."""
     await update.callback_query.answer()
     person: str = update.callback_query.data
-    context.user_data['person'] = person
+    context.user_data.person = person
     logger.info('Пользователь %s выбрал личность %s',
                 update.effective_user.id, person)
     await talk_with_person(update, context)
@@ -139,7 +217,7 @@ async def select_person(
 async def talk_with_person(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает разговор с выбранной личностью."""
-    person: str = context.user_data.get('person')
+    person: str = context.user_data.person
 
     if person:
         chat_gpt.set_prompt(PERSONS[person]['prompt'])
@@ -162,6 +240,7 @@ async def talk_with_person(
     return TALK
 
 
+@track_handler(TALK_MESSAGE)
 async def change_person(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает запрос пользователя на изменение личности."""
@@ -172,11 +251,12 @@ async def change_person(
     return TALK
 
 
+@track_handler(TALK_MESSAGE)
 async def talk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает сообщения от пользователя в режиме разговора с
     личностью.
     """
-    person: str = context.user_data.get('person')
+    person: str = context.user_data.person
 
     if person:
         user_message: str = update.message.text
@@ -194,6 +274,7 @@ async def talk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     return TALK
 
 
+@track_handler(QUIZ_MESSAGE)
 async def quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает команду /quiz и показывает доступные темы квизов."""
     logger.info('Пользователь %s вызвал команду /quiz',
@@ -204,21 +285,23 @@ async def quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return QUIZ
 
 
+@track_handler(QUIZ_MESSAGE)
 async def quiz_topic_selected(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает выбор темы квиза пользователем."""
     await update.callback_query.answer()
     chat_gpt.set_prompt(load_prompt(QUIZ_MESSAGE))
     user_message: str = update.callback_query.data
-    context.user_data['quiz_topic'] = user_message
-    context.user_data['correct_answers'] = 0
-    answer: str = await chat_gpt.add_message(user_message)
+    context.user_data.quiz_topic = user_message
+    context.user_data.correct_answers = 0
+    answer: str = await ask_quiz_question(user_message, user_message)
     await send_html(update, context, answer)
     logger.info('Пользователь %s выбрал тему квиза: %s',
                 update.effective_user.id, user_message)
     return QUIZ
 
 
+@track_handler(QUIZ_MESSAGE)
 async def handle_quiz_answer(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает ответ пользователя на вопрос квиза."""
@@ -229,10 +312,10 @@ async def handle_quiz_answer(
         try:
             answer: str = await chat_gpt.add_message(user_answer)
             if answer == CORRECT_ANSWER:
-                context.user_data['correct_answers'] += 1
+                context.user_data.correct_answers += 1
             await send_html(update, context, answer)
-            current_score: int = context.user_data.get('correct_answers', 0)
-            topic_key: str = context.user_data.get('quiz_topic')
+            current_score: int = context.user_data.correct_answers
+            topic_key: str = context.user_data.quiz_topic
             current_topic: str = TRANSLATE_QUIZ_TOPICS.get(topic_key)
             await send_html(
                 update,
@@ -254,6 +337,7 @@ async def handle_quiz_answer(
     return QUIZ
 
 
+@track_handler(QUIZ_MESSAGE)
 async def change_quiz_topic(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает запрос пользователя на изменение темы квиза."""
@@ -264,15 +348,16 @@ async def change_quiz_topic(
     return QUIZ
 
 
+@track_handler(QUIZ_MESSAGE)
 async def quiz_more(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запрашивает новый вопрос по текущей теме квиза."""
     await update.callback_query.answer()
-    topic: str = context.user_data.get('quiz_topic')
+    topic: str = context.user_data.quiz_topic
     if topic:
         question: str = f'Задай вопрос по теме {topic}.'
         try:
-            answer: str = await chat_gpt.add_message(question)
+            answer: str = await ask_quiz_question(topic, question)
             await send_html(update, context, answer)
             logger.info(
                 'Пользователь %s запрашивает еще один вопрос по теме %s',
@@ -289,21 +374,20 @@ async def quiz_more(
     return QUIZ
 
 
-async def new_word(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def send_new_word(
+        update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет пользователю новое слово."""
-    logger.info('Запрос на новое слово от пользователя %s',
-                update.effective_user.id)
-
     prompt: str = load_prompt(NEW_WORD_MESSAGE)
     message = load_message(NEW_WORD_MESSAGE)
     message = await send_response(update, context, NEW_WORD_MESSAGE, message)
 
     try:
-        answer: str = await chat_gpt.send_question(prompt, '')
+        answer: str = (content_store.choice(NEW_WORD_MESSAGE)
+                       or await chat_gpt.send_question(prompt, ''))
         logger.info('Ответ от GPT: %s', answer)
 
         if message is not None:
-            await message.edit_text(answer)
+            await edit_text(message, answer)
         else:
             logger.error('Сообщение не инициализировано корректно.')
 
@@ -317,29 +401,40 @@ async def new_word(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     except Exception as e:
         logger.error('Ошибка при получении слова: %s', str(e))
         await update.message.reply_text(ERROR_MESSAGE.format(error=str(e)))
+
+
+@track_handler(NEW_WORD_MESSAGE)
+async def new_word(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Отправляет пользователю новое слово."""
+    logger.info('Запрос на новое слово от пользователя %s',
+                update.effective_user.id)
+    await send_new_word(update, context)
     return NEW_WORD
 
 
+@track_handler(NEW_WORD_MESSAGE)
 async def one_more_new_word(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает запрос на получение еще одного слова."""
     logger.info('Пользователь %s запрашивает новое слово',
                 update.effective_user.id)
     await update.callback_query.answer()
-    await new_word(update, context)
+    await send_new_word(update, context)
     return NEW_WORD
 
 
+@track_handler(START_MESSAGE)
 async def main_menu(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Возвращает пользователя в главное меню."""
     logger.info('Пользователь %s возвращается в главное меню',
                 update.effective_user.id)
     await update.callback_query.answer()
-    await start(update, context)
+    await send_start_menu(update, context)
     return MAIN
 
-conv_handler = ConversationHandler(
+
+conv_handler = SessionConversationHandler(
     entry_points=[
         CommandHandler('start', start),
         CommandHandler('random', random),
@@ -390,9 +485,31 @@ conv_handler = ConversationHandler(
         CommandHandler('start', start)
     ],
     allow_reentry=True,
+    volatile_states=(GPT, TALK, QUIZ),
 )
 
 if __name__ == '__main__':
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    if METRICS_PORT:
+        try:
+            start_metrics_server(int(METRICS_PORT))
+            logger.info('Метрики доступны на 127.0.0.1:%s/metrics',
+                        METRICS_PORT)
+        except OSError as e:
+            logger.warning('Не удалось запустить эндпоинт метрик на порту '
+                           '%s: %s', METRICS_PORT, str(e))
+    if TRACE_SLOW_MS:
+        configure_tracing(TRACE_FILE, float(TRACE_SLOW_MS))
+        logger.info('Апдейты дольше %s мс пишутся в %s',
+                    TRACE_SLOW_MS, TRACE_FILE)
+    app = (ApplicationBuilder()
+           .token(BOT_TOKEN)
+           .context_types(CONTEXT_TYPES)
+           .concurrent_updates(lifecycle)
+           .post_init(post_init)
+           .post_stop(post_stop)
+           .build())
+    sweeper.register(app, conv_handler)
     app.add_handler(conv_handler)
+    # lifecycle.post_init() заменяет обработчики SIGTERM и SIGINT,
+    # которые run_polling() ставит там, где платформа это позволяет
     app.run_polling()
@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import IO, Any, NamedTuple
+
+# Режимы работы кассеты
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Через сколько записей сбрасывать буфер записи на диск
+FLUSH_EVERY = 100
+
+# Поля запроса, которые входят в отпечаток
+FINGERPRINT_FIELDS = ('model', 'messages', 'max_tokens', 'temperature')
+
+
+class CassetteMiss(KeyError):
+    """Для запроса нет записи в кассете."""
+
+
+class CassetteEntry(NamedTuple):
+    """
+    Записанный ответ модели.
+
+    Attributes:
+        fingerprint (str): Отпечаток запроса.
+        content (str): Текст ответа модели.
+        usage (dict[str, int]): Число токенов из поля usage ответа.
+        latency (float): Длительность исходного запроса в секундах.
+    """
+
+    fingerprint: str
+    content: str
+    usage: dict[str, int]
+    latency: float
+
+
+def normalize_messages(messages: list[Any]) -> list[dict[str, str]]:
+    """
+    Приводит сообщения к словарям role/content. В истории ChatGptService
+    ответы модели хранятся объектами ChatCompletionMessage.
+
+    Args:
+        messages (list[Any]): Список сообщений запроса.
+
+    Returns:
+        list[dict[str, str]]: Сообщения в виде словарей.
+    """
+    return [
+        {'role': message['role'], 'content': message['content']}
+        if isinstance(message, dict)
+        else {'role': message.role, 'content': message.content}
+        for message in messages
+    ]
+
+
+def fingerprint(request: dict[str, Any]) -> str:
+    """
+    Вычисляет отпечаток запроса к модели.
+
+    Args:
+        request (dict[str, Any]): Параметры chat.completions.create().
+
+    Returns:
+        str: Хэш значимых полей запроса.
+    """
+    payload: dict[str, Any] = {
+        field: request.get(field) for field in FINGERPRINT_FIELDS}
+    payload['messages'] = normalize_messages(payload['messages'] or [])
+    data: bytes = json.dumps(
+        payload, ensure_ascii=False, sort_keys=True).encode('utf8')
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf8')
+    return open(path, mode, encoding='utf8')
+
+
+class Cassette:
+    """
+    Кассета для записи и воспроизведения ответов модели. Хранится в
+    файле JSON Lines (со сжатием gzip, если путь оканчивается на .gz),
+    одна строка на ответ. При записи файл открыт всю сессию и
+    сбрасывается на диск каждые FLUSH_EVERY записей и в close().
+
+    Attributes:
+        path (str): Путь к файлу кассеты.
+        mode (str): RECORD или REPLAY.
+        speed (float): Множитель исходных задержек при воспроизведении
+            (1 - исходный темп, 0 - без задержек).
+        strict (bool): Требовать ли точного совпадения отпечатка. Без
+            него неизвестные запросы получают записи по порядку.
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, speed: float = 1.0,
+                 strict: bool = True) -> None:
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f'Неизвестный режим кассеты: {mode}')
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: list[CassetteEntry] = []
+        self._by_fingerprint: dict[str, list[CassetteEntry]] = (
+            defaultdict(list))
+        self._positions: dict[str, int] = defaultdict(int)
+        self._position: int = 0
+        self._writer: IO[str] | None = None
+        self._unflushed: int = 0
+        if mode == REPLAY:
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        """Работает ли кассета в режиме воспроизведения."""
+        return self.mode == REPLAY
+
+    def _load(self) -> None:
+        with _open(self.path, 'r') as file:
+            try:
+                for line in file:
+                    if line.strip():
+                        entry = CassetteEntry(**json.loads(line))
+                        self._entries.append(entry)
+                        self._by_fingerprint[entry.fingerprint].append(
+                            entry)
+            except EOFError:
+                # Запись прервалась до close(): сжатый поток не завершён,
+                # но всё, что успело сброситься на диск, читается
+                pass
+        if not self._entries:
+            raise ValueError(f'Кассета {self.path} пуста')
+
+    def record(self, request: dict[str, Any], content: str,
+               usage: dict[str, int], latency: float) -> None:
+        """
+        Дописывает ответ модели в кассету.
+
+        Args:
+            request (dict[str, Any]): Параметры запроса к модели.
+            content (str): Текст ответа.
+            usage (dict[str, int]): Число токенов из поля usage.
+            latency (float): Длительность запроса в секундах.
+        """
+        entry = CassetteEntry(
+            fingerprint(request), content, usage, round(latency, 4))
+        line: str = json.dumps(entry._asdict(), ensure_ascii=False)
+        with self._lock:
+            if self._writer is None:
+                directory: str = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._writer = _open(self.path, 'a')
+            self._writer.write(line + '\n')
+            self._unflushed += 1
+            if self._unflushed >= FLUSH_EVERY:
+                self._writer.flush()
+                self._unflushed = 0
+
+    def close(self) -> None:
+        """Сбрасывает записанные ответы на диск и закрывает файл."""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+                self._unflushed = 0
+
+    def next_entry(self, request: dict[str, Any]) -> CassetteEntry:
+        """
+        Возвращает запись для запроса. Повторяющиеся запросы получают
+        записанные ответы по кругу, поэтому воспроизведение
+        детерминировано.
+
+        Args:
+            request (dict[str, Any]): Параметры запроса к модели.
+
+        Returns:
+            CassetteEntry: Записанный ответ.
+
+        Raises:
+            CassetteMiss: Запрос не записан, а кассета строгая.
+        """
+        key: str = fingerprint(request)
+        with self._lock:
+            entries: list[CassetteEntry] = self._by_fingerprint.get(key, [])
+            if entries:
+                index: int = self._positions[key]
+                self._positions[key] = index + 1
+                return entries[index % len(entries)]
+            if self.strict:
+                raise CassetteMiss(key)
+            entry: CassetteEntry = self._entries[
+                self._position % len(self._entries)]
+            self._position += 1
+            return entry
+
+    def delay(self, entry: CassetteEntry) -> float:
+        """
+        Возвращает задержку воспроизведения записи с учётом speed.
+
+        Args:
+            entry (CassetteEntry): Запись кассеты.
+
+        Returns:
+            float: Задержка в секундах.
+        """
+        return entry.latency * self.speed
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+
+from metrics import CONTENT_POOL_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Запись индекса: смещение и длина текста в файле данных
+INDEX_RECORD = struct.Struct('<QI')
+
+DATA_SUFFIX = '.bin'
+INDEX_SUFFIX = '.idx'
+
+
+def content_hash(text: str) -> bytes:
+    """
+    Вычисляет хэш текста для дедупликации без учёта регистра и пробелов.
+
+    Args:
+        text (str): Текст записи.
+
+    Returns:
+        bytes: Хэш нормализованного текста.
+    """
+    normalized: str = re.sub(r'\s+', ' ', text).strip().casefold()
+    return hashlib.sha256(normalized.encode('utf8')).digest()[:16]
+
+
+class ContentPool:
+    """
+    Пул готовых текстов одного типа, отображённый в память. Текст
+    хранится в файле данных, смещения - в файле индекса.
+
+    Attributes:
+        name (str): Имя пула.
+
+    Raises:
+        OSError: Если файл данных или индекса не открывается.
+        ValueError: Если индекс ссылается за пределы файла данных.
+    """
+
+    def __init__(self, directory: str, name: str) -> None:
+        self.name = name
+        self._data: mmap.mmap | None = None
+        self._index: mmap.mmap | None = None
+        self._count: int = 0
+        index_path: str = os.path.join(directory, name + INDEX_SUFFIX)
+        data_path: str = os.path.join(directory, name + DATA_SUFFIX)
+        count: int = os.path.getsize(index_path) // INDEX_RECORD.size
+        if not count:
+            return
+        data_size: int = os.path.getsize(data_path)
+        with open(index_path, 'rb') as file:
+            # Записи дописываются по порядку, поэтому последняя
+            # заканчивается дальше всех
+            file.seek((count - 1) * INDEX_RECORD.size)
+            offset, length = INDEX_RECORD.unpack(
+                file.read(INDEX_RECORD.size))
+            if offset + length > data_size:
+                raise ValueError(
+                    f'Индекс пула {name} ссылается за конец файла данных')
+            self._index = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(data_path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> str:
+        offset, length = INDEX_RECORD.unpack_from(
+            self._index, position * INDEX_RECORD.size)
+        return self._data[offset:offset + length].decode('utf8')
+
+    def close(self) -> None:
+        """Закрывает отображения файлов."""
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._data = self._index = None
+        self._count = 0
+
+
+class ContentStore:
+    """
+    Набор пулов готовых текстов (случайные факты, слова, вопросы квиза),
+    заранее сгенерированных pregenerate.py.
+
+    Attributes:
+        directory (str): Каталог с файлами пулов.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._pools: dict[str, ContentPool] = {}
+        self._random = random.Random()
+
+    def load(self) -> None:
+        """
+        Отображает в память все пулы из каталога. Повреждённые пулы
+        пропускаются: вместо них бот обращается к модели.
+        """
+        pools: dict[str, ContentPool] = {}
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                name, suffix = os.path.splitext(file_name)
+                if suffix != INDEX_SUFFIX:
+                    continue
+                try:
+                    pools[name] = ContentPool(self.directory, name)
+                except (OSError, ValueError) as e:
+                    logger.error('Пул %s пропущен: %s', name, str(e))
+        old_pools, self._pools = self._pools, pools
+        for pool in old_pools.values():
+            pool.close()
+
+    def sizes(self) -> dict[str, int]:
+        """
+        Возвращает число записей в каждом пуле.
+
+        Returns:
+            dict[str, int]: Размеры пулов.
+        """
+        return {name: len(pool) for name, pool in self._pools.items()}
+
+    def choice(self, name: str) -> str | None:
+        """
+        Возвращает случайный текст из пула.
+
+        Args:
+            name (str): Имя пула.
+
+        Returns:
+            str | None: Текст или None, если пул пуст или отсутствует.
+        """
+        pool: ContentPool | None = self._pools.get(name)
+        if not pool:
+            CONTENT_POOL_REQUESTS.inc(pool=name, result='miss')
+            return None
+        CONTENT_POOL_REQUESTS.inc(pool=name, result='hit')
+        return pool[self._random.randrange(len(pool))]
+
+
+class ContentStoreWriter:
+    """
+    Дописывает тексты в пулы, пропуская дубликаты.
+
+    Attributes:
+        directory (str): Каталог с файлами пулов.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._seen: dict[str, set[bytes]] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, name: str) -> tuple[str, str]:
+        base: str = os.path.join(self.directory, name)
+        return base + DATA_SUFFIX, base + INDEX_SUFFIX
+
+    def _seen_hashes(self, name: str) -> set[bytes]:
+        if name not in self._seen:
+            seen: set[bytes] = set()
+            if os.path.exists(self._paths(name)[1]):
+                pool = ContentPool(self.directory, name)
+                seen.update(
+                    content_hash(pool[i]) for i in range(len(pool)))
+                pool.close()
+            self._seen[name] = seen
+        return self._seen[name]
+
+    def add(self, name: str, text: str) -> bool:
+        """
+        Добавляет текст в пул, если его там ещё нет.
+
+        Args:
+            name (str): Имя пула.
+            text (str): Текст записи.
+
+        Returns:
+            bool: True, если текст добавлен.
+        """
+        text = text.strip()
+        if not text:
+            return False
+        digest: bytes = content_hash(text)
+        seen: set[bytes] = self._seen_hashes(name)
+        if digest in seen:
+            return False
+        data_path, index_path = self._paths(name)
+        encoded: bytes = text.encode('utf8')
+        # Сначала данные, затем индекс: при сбое в индексе не окажется
+        # ссылки на недописанную запись
+        with open(data_path, 'ab') as file:
+            offset: int = file.tell()
+            file.write(encoded)
+        with open(index_path, 'ab') as file:
+            file.write(INDEX_RECORD.pack(offset, len(encoded)))
+        seen.add(digest)
+        return True
@@ -0,0 +1,222 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs
+
+from cassette import Cassette, CassetteEntry
+
+# Идентификатор и имя бота, которые возвращает фейковый getMe
+FAKE_BOT_ID = 1000
+FAKE_BOT_USERNAME = 'fake_bench_bot'
+
+# Текст, из которого собираются ответы фейковой модели
+FAKE_COMPLETION_WORDS = ('Это', 'ответ', 'фейковой', 'модели', 'для',
+                         'нагрузочного', 'теста')
+
+
+class _FakeServer:
+    """
+    Базовый класс локального HTTP-сервера с задержкой, ошибками и
+    подсчётом запросов.
+
+    Attributes:
+        latency (float): Базовая задержка ответа в секундах.
+        error_rate (float): Доля запросов, на которые отвечается ошибкой.
+        calls (Counter): Число запросов по методам.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int | None = None) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Базовый адрес сервера."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> '_FakeServer':
+        """Запускает сервер в фоновом потоке."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Останавливает сервер."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        """Сбрасывает счётчики запросов."""
+        with self._lock:
+            self.calls.clear()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _count(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+
+    def handle(self, method: str, body: bytes,
+               content_type: str) -> tuple[int, dict[str, Any]]:
+        raise NotImplementedError
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get('Content-Length', 0))
+                body: bytes = self.rfile.read(length)
+                method: str = self.path.rstrip('/').rsplit('/', 1)[-1]
+                status, payload = server.handle(
+                    method, body, self.headers.get('Content-Type', ''))
+                data: bytes = json.dumps(payload).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+
+class FakeTelegramServer(_FakeServer):
+    """
+    Фейковый Bot API: принимает методы, которые использует бот, и
+    возвращает минимально валидные ответы.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int | None = None) -> None:
+        super().__init__(latency, error_rate, seed)
+        self._message_id = 0
+
+    def _next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _message(self, params: dict[str, str]) -> dict[str, Any]:
+        chat_id: int = int(params.get('chat_id') or 0)
+        return {
+            'message_id': int(params.get('message_id') or 0)
+            or self._next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+
+    def handle(self, method: str, body: bytes,
+               content_type: str) -> tuple[int, dict[str, Any]]:
+        self._count(method)
+        if self.latency:
+            time.sleep(self.latency)
+        if method != 'getMe' and self._should_fail():
+            return 500, {'ok': False, 'error_code': 500,
+                         'description': 'Internal Server Error: injected'}
+        params: dict[str, str] = {}
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            params = {key: values[0] for key, values in
+                      parse_qs(body.decode('utf8')).items()}
+        if method == 'getMe':
+            result: Any = {'id': FAKE_BOT_ID, 'is_bot': True,
+                           'first_name': 'Fake', 'username': FAKE_BOT_USERNAME}
+        elif method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+
+class FakeOpenAIServer(_FakeServer):
+    """
+    Фейковый OpenAI-совместимый сервер с эндпоинтом chat/completions.
+
+    Attributes:
+        token_rate (float): Скорость генерации в токенах в секунду
+            (0 - без задержки на генерацию).
+        completion_tokens (int): Число токенов в каждом ответе.
+        cassette (Cassette | None): Кассета, из которой берутся ответы
+            и их задержки вместо синтетических.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 token_rate: float = 0.0, completion_tokens: int = 50,
+                 seed: int | None = None,
+                 cassette: Cassette | None = None) -> None:
+        super().__init__(latency, error_rate, seed)
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.cassette = cassette
+
+    def _synthetic_entry(self, request: dict[str, Any]) -> CassetteEntry:
+        prompt_tokens: int = sum(
+            len(str(message.get('content', '')).split())
+            for message in request.get('messages', []))
+        content: str = ' '.join(
+            FAKE_COMPLETION_WORDS[i % len(FAKE_COMPLETION_WORDS)]
+            for i in range(self.completion_tokens))
+        latency: float = self.latency
+        if self.token_rate:
+            latency += self.completion_tokens / self.token_rate
+        return CassetteEntry('', content, {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': prompt_tokens + self.completion_tokens,
+        }, latency)
+
+    def handle(self, method: str, body: bytes,
+               content_type: str) -> tuple[int, dict[str, Any]]:
+        self._count(method)
+        if method == 'models':
+            return 200, {'object': 'list', 'data': []}
+        if method != 'completions':
+            return 404, {'error': {'message': f'Unknown method {method}'}}
+        request: dict[str, Any] = json.loads(body or b'{}')
+        if self.cassette is not None:
+            entry: CassetteEntry = self.cassette.next_entry(request)
+            delay: float = self.cassette.delay(entry)
+        else:
+            entry = self._synthetic_entry(request)
+            delay = entry.latency
+        if delay:
+            time.sleep(delay)
+        if self._should_fail():
+            return 500, {'error': {'message': 'Injected error',
+                                   'type': 'server_error'}}
+        return 200, {
+            'id': f'chatcmpl-fake-{self.calls[method]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': entry.content},
+                'finish_reason': 'stop',
+            }],
+            'usage': entry.usage,
+        }
@@ -1,11 +1,30 @@
+import asyncio
+import logging
 import os
+import time
 
 import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from openai.types import CompletionUsage
+
+from cassette import Cassette
+from metrics import record_tokens, track_call
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROXY = "http://18.199.183.77:49232"
+
+# Параметры запросов к модели
+GPT_MODEL = "gpt-4-turbo"  # gpt-4o, gpt-4-turbo, GPT-4o mini
+MAX_TOKENS = 3000
+TEMPERATURE = 0.9
+
+# Сколько секунд ждать проверку соединения при прогреве
+WARM_UP_TIMEOUT = 5
+
 
 class ChatGptService:
     """
@@ -16,13 +35,19 @@ class ChatGptService:
     промпта. Он использует API OpenAI для получения ответов от модели.
 
     Attributes:
-        client (OpenAI): Клиент OpenAI для взаимодействия с API.
+        client (OpenAI): Синхронный клиент OpenAI для скриптов.
+        async_client (AsyncOpenAI): Асинхронный клиент OpenAI для
+        запросов бота.
         message_list (list[dict[str, str]]): Список сообщений,
         отправляемых в модель.
+        cassette (Cassette | None): Кассета для записи или
+        воспроизведения ответов модели.
     """
 
     client: OpenAI
+    async_client: AsyncOpenAI
     message_list: list[dict[str, str]]
+    cassette: Cassette | None
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -30,39 +55,104 @@ class ChatGptService:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, token: str) -> None:
+    def __init__(self, token: str, cassette: Cassette | None = None) -> None:
+        if token is None and cassette is not None and cassette.replaying:
+            # Воспроизведение работает без обращений к API
+            token = 'sk-replay'
         token = (
             "sk-proj-" + token[:3:-1] if token.startswith('gpt:') else token)
+        proxy: str = os.environ.get('OPENAI_PROXY', DEFAULT_PROXY)
         self.client = OpenAI(
-            http_client=httpx.Client(proxies="http://18.199.183.77:49232"),
+            http_client=httpx.Client(proxies=proxy or None),
+            api_key=token
+        )
+        self.async_client = AsyncOpenAI(
+            http_client=httpx.AsyncClient(proxies=proxy or None),
             api_key=token
         )
         self.message_list = []
+        self.cassette = cassette
 
     @staticmethod
     def get_instance():
         ChatGPT_TOKEN = os.environ.get('ChatGPT_TOKEN')
+        GPT_CASSETTE = os.environ.get('GPT_CASSETTE')
         if not ChatGptService._instance:
-            ChatGptService._instance = ChatGptService(ChatGPT_TOKEN)
+            cassette: Cassette | None = None
+            if GPT_CASSETTE:
+                cassette = Cassette(
+                    GPT_CASSETTE,
+                    mode=os.environ.get('GPT_CASSETTE_MODE', 'replay'),
+                    speed=float(os.environ.get('GPT_CASSETTE_SPEED', '1')))
+            ChatGptService._instance = ChatGptService(ChatGPT_TOKEN, cassette)
         return ChatGptService._instance
 
+    @track_call('gpt')
     async def send_message_list(self) -> str:
         """
-        Отправляет список сообщений в модель и возвращает ответ.
+        Отправляет список сообщений в модель и возвращает ответ. Если
+        подключена кассета, ответ записывается в неё или берётся из неё.
 
         Returns:
             str: Ответ от модели в виде строки.
         """
-        completion = self.client.chat.completions.create(
-            model="gpt-4-turbo",  # gpt-4o, gpt-4-turbo, GPT-4o mini
+        request: dict = dict(
+            model=GPT_MODEL,
             messages=self.message_list,
-            max_tokens=3000,
-            temperature=0.9
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE
         )
+        if self.cassette is not None and self.cassette.replaying:
+            entry = self.cassette.next_entry(request)
+            await asyncio.sleep(self.cassette.delay(entry))
+            record_tokens(
+                CompletionUsage(**entry.usage) if entry.usage else None)
+            self.message_list.append(
+                {"role": "assistant", "content": entry.content})
+            return entry.content
+
+        start: float = time.perf_counter()
+        # Асинхронный клиент не блокирует цикл событий, а отмена задачи
+        # при остановке бота сразу прерывает запрос
+        completion = await self.async_client.chat.completions.create(
+            **request)
+        record_tokens(completion.usage)
         message = completion.choices[0].message
+        if self.cassette is not None:
+            self.cassette.record(
+                request, message.content,
+                completion.usage.model_dump(exclude_none=True)
+                if completion.usage else {},
+                time.perf_counter() - start)
         self.message_list.append(message)
         return message.content
 
+    async def warm_up(self) -> None:
+        """
+        Открывает соединение с API заранее, чтобы первый запрос
+        пользователя не тратил время на установку соединения.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return
+        try:
+            # Без повторов и с общим лимитом: зависший прокси не должен
+            # откладывать начало работы бота
+            await asyncio.wait_for(
+                self.async_client.with_options(
+                    timeout=WARM_UP_TIMEOUT, max_retries=0).models.list(),
+                WARM_UP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning('OpenAI не ответил за %s с при прогреве',
+                           WARM_UP_TIMEOUT)
+        except Exception as e:
+            logger.warning('Не удалось прогреть соединение с OpenAI: %s',
+                           str(e))
+
+    def close(self) -> None:
+        """Сохраняет записанные в кассету ответы."""
+        if self.cassette is not None:
+            self.cassette.close()
+
     def set_prompt(self, prompt_text: str) -> None:
         """
         Устанавливает системный промпт и очищает список сообщений.
@@ -73,6 +163,7 @@ class ChatGptService:
         self.message_list.clear()
         self.message_list.append({"role": "system", "content": prompt_text})
 
+    @track_call('gpt')
     async def add_message(self, message_text: str) -> str:
         """
         Добавляет сообщение пользователя в список и получает ответ от
@@ -87,6 +178,7 @@ class ChatGptService:
         self.message_list.append({"role": "user", "content": message_text})
         return await self.send_message_list()
 
+    @track_call('gpt')
     async def send_question(self, prompt_text: str, message_text: str) -> str:
         """
         Устанавливает системный промпт, добавляет сообщение пользователя
@@ -103,3 +195,15 @@ class ChatGptService:
         self.message_list.append({"role": "system", "content": prompt_text})
         self.message_list.append({"role": "user", "content": message_text})
         return await self.send_message_list()
+
+    def add_exchange(self, message_text: str, answer_text: str) -> None:
+        """
+        Добавляет в список сообщение пользователя и готовый ответ модели,
+        например, взятый из пула заранее сгенерированных текстов.
+
+        Args:
+            message_text (str): Текст сообщения пользователя.
+            answer_text (str): Текст ответа модели.
+        """
+        self.message_list.append({"role": "user", "content": message_text})
+        self.message_list.append({"role": "assistant", "content": answer_text})
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import Application, SimpleUpdateProcessor
+
+from metrics import DRAIN_CHECKPOINTED, IN_FLIGHT_UPDATES
+
+logger = logging.getLogger(__name__)
+
+
+def is_replayable(update: object) -> bool:
+    """
+    Можно ли обработать апдейт заново после перезапуска. Нажатия кнопок
+    не повторяются: после остановки и перезапуска callback-запрос уже
+    устарел, и ответить на него нельзя.
+
+    Args:
+        update (object): Апдейт из очереди.
+
+    Returns:
+        bool: True для сообщений пользователя.
+    """
+    return isinstance(update, Update) and update.message is not None
+
+
+class Lifecycle(SimpleUpdateProcessor):
+    """
+    Обработчик апдейтов с корректной остановкой. Каждый апдейт
+    обрабатывается в собственной задаче. По SIGTERM бот перестаёт
+    получать новые апдейты и даёт начатым время завершиться, затем
+    отменяет только эти задачи. Сообщения, обработка которых ещё не
+    началась, сохраняются в файл и обрабатываются после перезапуска.
+    Начатые апдейты не повторяются, чтобы не отправлять пользователю
+    те же сообщения дважды.
+
+    Передаётся в ApplicationBuilder.concurrent_updates().
+
+    Attributes:
+        checkpoint_path (str): Файл с необработанными апдейтами.
+        drain_timeout (float): Сколько секунд ждать начатые апдейты.
+        draining (bool): Идёт ли остановка.
+    """
+
+    def __init__(self, checkpoint_path: str, drain_timeout: float,
+                 max_concurrent_updates: int = 1) -> None:
+        super().__init__(max_concurrent_updates)
+        self.checkpoint_path = checkpoint_path
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self._in_flight: dict[asyncio.Task, object] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._drain_task: asyncio.Task | None = None
+
+    async def do_process_update(self, update: object,
+                                coroutine: Awaitable[Any]) -> None:
+        """
+        Обрабатывает апдейт в отдельной задаче. Во время остановки
+        сохраняет апдейт в файл вместо обработки.
+
+        Args:
+            update (object): Апдейт из очереди.
+            coroutine (Awaitable[Any]): Обработка апдейта приложением.
+        """
+        if self.draining:
+            coroutine.close()
+            self.checkpoint([update])
+            return
+        task: asyncio.Task = asyncio.ensure_future(coroutine)
+        self._in_flight[task] = update
+        self._idle.clear()
+        IN_FLIGHT_UPDATES.set(len(self._in_flight))
+        try:
+            # Не await task: отмена задачи при остановке не должна
+            # доходить до задачи приложения, которая читает очередь
+            await asyncio.wait((task,))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            self._in_flight.pop(task, None)
+            IN_FLIGHT_UPDATES.set(len(self._in_flight))
+            if not self._in_flight:
+                self._idle.set()
+
+    def checkpoint(self, updates: list[object]) -> None:
+        """
+        Дописывает в файл апдейты, которые можно обработать после
+        перезапуска. Остальные пропускаются.
+
+        Args:
+            updates (list[object]): Необработанные апдейты.
+        """
+        replayable: list[Update] = [
+            update for update in updates if is_replayable(update)]
+        if len(replayable) < len(updates):
+            logger.warning('Пропущено необработанных апдейтов: %s',
+                           len(updates) - len(replayable))
+        if not replayable:
+            return
+        with open(self.checkpoint_path, 'a', encoding='utf8') as file:
+            for update in replayable:
+                file.write(json.dumps(update.to_dict(), ensure_ascii=False)
+                           + '\n')
+        DRAIN_CHECKPOINTED.inc(len(replayable))
+        logger.warning('Сохранено необработанных апдейтов: %s',
+                       len(replayable))
+
+    async def replay(self, application: Application) -> int:
+        """
+        Ставит в очередь апдейты, сохранённые при прошлой остановке.
+
+        Args:
+            application (Application): Приложение бота.
+
+        Returns:
+            int: Число восстановленных апдейтов.
+        """
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf8') as file:
+                lines: list[str] = [line for line in file if line.strip()]
+        except FileNotFoundError:
+            return 0
+        for line in lines:
+            await application.update_queue.put(
+                Update.de_json(json.loads(line), application.bot))
+        os.remove(self.checkpoint_path)
+        logger.info('Восстановлено необработанных апдейтов: %s', len(lines))
+        return len(lines)
+
+    async def drain(self, application: Application) -> None:
+        """
+        Останавливает получение апдейтов, ждёт начатые апдейты не дольше
+        drain_timeout, отменяет оставшиеся, сохраняет ещё не начатые и
+        останавливает приложение.
+
+        Args:
+            application (Application): Приложение бота.
+        """
+        started: float = time.monotonic()
+        self.draining = True
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        # Апдейты из очереди уже не начнутся: сохраняем их разом
+        queued: list[object] = []
+        while not application.update_queue.empty():
+            queued.append(application.update_queue.get_nowait())
+            application.update_queue.task_done()
+        self.checkpoint(queued)
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            tasks: list[asyncio.Task] = list(self._in_flight)
+            logger.warning('Прервана обработка апдейтов: %s', [
+                getattr(update, 'update_id', None)
+                for update in self._in_flight.values()])
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info('Остановка заняла %.1f с', time.monotonic() - started)
+        application.stop_running()
+
+    async def post_init(self, application: Application) -> None:
+        """
+        Восстанавливает сохранённые апдейты и перехватывает SIGTERM и
+        SIGINT вместо обработчиков, установленных run_polling().
+        Вызывается после прогрева, до начала получения апдейтов.
+
+        Args:
+            application (Application): Приложение бота.
+        """
+        await self.replay(application)
+        loop = asyncio.get_running_loop()
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, self._on_signal, application)
+        except NotImplementedError:
+            # Например, в Windows: остаётся остановка PTB по умолчанию,
+            # без ожидания начатых апдейтов
+            logger.warning('Цикл событий не поддерживает обработчики '
+                           'сигналов, апдейты при остановке не сохраняются')
+
+    def _on_signal(self, application: Application) -> None:
+        if self.draining:
+            return
+        logger.info('Получен сигнал остановки, завершаем начатые апдейты')
+        # Цикл событий хранит на задачи только слабые ссылки
+        self._drain_task = asyncio.get_running_loop().create_task(
+            self.drain(application))
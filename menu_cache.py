@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Файл сжимается, когда строк в нём больше удвоенного числа чатов, но не
+# раньше, чем наберётся столько строк
+MIN_COMPACT_LINES = 1024
+
+
+def commands_hash(commands: dict[str, str]) -> str:
+    """
+    Вычисляет хэш набора команд меню.
+
+    Args:
+        commands (dict[str, str]): Словарь команд (ключ - команда,
+        значение - описание).
+
+    Returns:
+        str: Хэш команд с учётом их порядка.
+    """
+    data: bytes = json.dumps(
+        list(commands.items()), ensure_ascii=False).encode('utf8')
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class MenuStateCache:
+    """
+    Запоминает, какой набор команд уже установлен в каждом чате, чтобы
+    не повторять set_my_commands и set_chat_menu_button. Изменения
+    дописываются в файл JSON Lines, поэтому состояние переживает
+    перезапуск бота. Файл сжимается при загрузке и когда строк в нём
+    становится вдвое больше, чем чатов.
+
+    Attributes:
+        path (str): Путь к файлу состояния.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._state: dict[str, str] | None = None
+        self._lines: int = 0
+
+    def _load(self) -> dict[str, str]:
+        if self._state is not None:
+            return self._state
+        self._state = {}
+        lines: int = 0
+        try:
+            with open(self.path, 'r', encoding='utf8') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    chat_id, digest = json.loads(line)
+                    lines += 1
+                    if digest is None:
+                        self._state.pop(chat_id, None)
+                    else:
+                        self._state[chat_id] = digest
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error('Не удалось прочитать кэш меню %s: %s',
+                         self.path, str(e))
+        self._lines = lines
+        if lines > len(self._state):
+            self._compact()
+        return self._state
+
+    def _compact(self) -> None:
+        tmp_path: str = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf8') as file:
+                for chat_id, digest in self._state.items():
+                    file.write(json.dumps([chat_id, digest]) + '\n')
+            os.replace(tmp_path, self.path)
+            self._lines = len(self._state)
+        except OSError as e:
+            logger.error('Не удалось сжать кэш меню %s: %s',
+                         self.path, str(e))
+
+    def _append(self, chat_id: str, digest: str | None) -> None:
+        try:
+            with open(self.path, 'a', encoding='utf8') as file:
+                file.write(json.dumps([chat_id, digest]) + '\n')
+        except OSError as e:
+            logger.error('Не удалось сохранить кэш меню %s: %s',
+                         self.path, str(e))
+            return
+        self._lines += 1
+        # Вытеснение сессий дописывает строки при каждом уходе и
+        # возвращении пользователя, поэтому сжимаем и во время работы
+        if self._lines > max(2 * len(self._state), MIN_COMPACT_LINES):
+            self._compact()
+
+    def is_current(self, chat_id: int, digest: str) -> bool:
+        """
+        Проверяет, установлен ли в чате набор команд с этим хэшем.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+            digest (str): Хэш набора команд.
+
+        Returns:
+            bool: True, если меню в чате уже актуально.
+        """
+        with self._lock:
+            return self._load().get(str(chat_id)) == digest
+
+    def remember(self, chat_id: int, digest: str) -> None:
+        """
+        Запоминает набор команд, установленный в чате.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+            digest (str): Хэш набора команд.
+        """
+        with self._lock:
+            self._load()[str(chat_id)] = digest
+            self._append(str(chat_id), digest)
+
+    def forget(self, chat_id: int) -> str | None:
+        """
+        Забывает состояние меню чата.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+
+        Returns:
+            str | None: Хэш набора команд, который был установлен в чате.
+        """
+        with self._lock:
+            digest: str | None = self._load().pop(str(chat_id), None)
+            if digest is not None:
+                self._append(str(chat_id), None)
+            return digest
@@ -0,0 +1,393 @@
+import asyncio
+import functools
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+import tracing
+
+# Границы бакетов гистограммы задержек (в секундах)
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Режим бота, в котором сейчас обрабатывается апдейт
+current_mode: ContextVar[str] = ContextVar('current_mode', default='none')
+
+
+class _Metric:
+    """
+    Базовый класс метрики с набором меток.
+
+    Attributes:
+        name (str): Имя метрики в формате Prometheus.
+        documentation (str): Описание метрики.
+        labelnames (tuple[str, ...]): Имена меток.
+    """
+
+    kind: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], Any] = {}
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple[str, ...],
+                       extra: dict[str, str] | None = None) -> str:
+        pairs: list[tuple[str, str]] = list(zip(self.labelnames, key))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ''
+        body: str = ','.join(
+            '{}="{}"'.format(name, value.replace('\\', '\\\\')
+                             .replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in pairs)
+        return '{' + body + '}'
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        Возвращает метрику в текстовом формате Prometheus.
+
+        Returns:
+            str: Строки HELP, TYPE и значения метрики.
+        """
+        lines: list[str] = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Увеличивает счётчик.
+
+        Args:
+            amount (float): Величина увеличения.
+            **labels (str): Значения меток.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f'{self.name}{self._format_labels(key)} {value}'
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Значение, которое может как расти, так и уменьшаться."""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """
+        Уменьшает значение.
+
+        Args:
+            amount (float): Величина уменьшения.
+            **labels (str): Значения меток.
+        """
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Устанавливает значение.
+
+        Args:
+            value (float): Новое значение.
+            **labels (str): Значения меток.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Добавляет наблюдение в гистограмму.
+
+        Args:
+            value (float): Наблюдаемое значение.
+            **labels (str): Значения меток.
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> list[str]:
+        lines: list[str] = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative: int = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, {'le': repr(bound)})
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = self._format_labels(key, {'le': '+Inf'})
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {total}')
+            lines.append(
+                f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+
+class Registry:
+    """Набор метрик, отдаваемых эндпоинтом /metrics."""
+
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Регистрирует метрику.
+
+        Args:
+            metric (_Metric): Метрика для регистрации.
+
+        Returns:
+            _Metric: Та же метрика.
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Возвращает все метрики в текстовом формате Prometheus.
+
+        Returns:
+            str: Содержимое ответа эндпоинта /metrics.
+        """
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', 'Длительность обработчиков апдейтов.',
+    ('handler', 'mode')))
+HANDLER_IN_FLIGHT = REGISTRY.register(Gauge(
+    'bot_handler_in_flight', 'Число выполняющихся обработчиков.',
+    ('handler', 'mode')))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Число исключений в обработчиках.',
+    ('handler', 'mode', 'error')))
+CALL_LATENCY = REGISTRY.register(Histogram(
+    'bot_call_duration_seconds',
+    'Длительность вызовов ChatGptService и хелперов util.',
+    ('component', 'call', 'mode')))
+CALL_IN_FLIGHT = REGISTRY.register(Gauge(
+    'bot_call_in_flight', 'Число выполняющихся вызовов.',
+    ('component', 'call', 'mode')))
+CALL_ERRORS = REGISTRY.register(Counter(
+    'bot_call_errors_total', 'Число исключений в вызовах.',
+    ('component', 'call', 'mode', 'error')))
+GPT_TOKENS = REGISTRY.register(Counter(
+    'bot_gpt_tokens_total', 'Число токенов, потраченных на запросы к модели.',
+    ('mode', 'kind')))
+RESIDENT_SESSIONS = REGISTRY.register(Gauge(
+    'bot_sessions_resident', 'Число сессий пользователей в памяти.'))
+SPILLED_SESSIONS = REGISTRY.register(Counter(
+    'bot_sessions_spilled_total', 'Число сессий, вытесненных на диск.'))
+PROCESS_MEMORY = REGISTRY.register(Gauge(
+    'bot_process_resident_bytes', 'Резидентная память процесса.'))
+IN_FLIGHT_UPDATES = REGISTRY.register(Gauge(
+    'bot_updates_in_flight', 'Число апдейтов в обработке.'))
+DRAIN_CHECKPOINTED = REGISTRY.register(Counter(
+    'bot_drain_checkpointed_total',
+    'Число апдейтов, сохранённых при остановке для повторной обработки.'))
+CONTENT_POOL_REQUESTS = REGISTRY.register(Counter(
+    'bot_content_pool_requests_total',
+    'Обращения к пулам заранее сгенерированных текстов.',
+    ('pool', 'result')))
+
+
+def track_handler(mode: str) -> Callable:
+    """
+    Декоратор для обработчиков апдейтов: замеряет задержку, число
+    одновременных вызовов и ошибки, выставляет текущий режим и открывает
+    корневой спан трейса апдейта.
+
+    Args:
+        mode (str): Режим бота, которым помечаются метрики.
+
+    Returns:
+        Callable: Декоратор для асинхронного обработчика.
+    """
+    def decorator(func: Callable) -> Callable:
+        handler: str = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = current_mode.set(mode)
+            span = tracing.start_span(
+                handler, root=True, mode=mode,
+                update_id=getattr(args[0] if args else None, 'update_id', ''))
+            error: Exception | None = None
+            HANDLER_IN_FLIGHT.inc(handler=handler, mode=mode)
+            start: float = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                error = e
+                HANDLER_ERRORS.inc(
+                    handler=handler, mode=mode, error=type(e).__name__)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(
+                    time.perf_counter() - start, handler=handler, mode=mode)
+                HANDLER_IN_FLIGHT.dec(handler=handler, mode=mode)
+                tracing.end_span(span, error)
+                current_mode.reset(token)
+        return wrapper
+    return decorator
+
+
+def track_call(component: str) -> Callable:
+    """
+    Декоратор для вызовов внешних сервисов и хелперов: метрики и
+    дочерний спан трейса. Поддерживает как синхронные, так и асинхронные
+    функции.
+
+    Args:
+        component (str): Имя компонента (например, 'gpt' или 'util').
+
+    Returns:
+        Callable: Декоратор для функции.
+    """
+    def decorator(func: Callable) -> Callable:
+        call: str = func.__name__
+
+        def before() -> tuple[str, float, Any]:
+            mode: str = current_mode.get()
+            span = tracing.start_span(call, component=component)
+            CALL_IN_FLIGHT.inc(component=component, call=call, mode=mode)
+            return mode, time.perf_counter(), span
+
+        def after(mode: str, start: float, span: Any,
+                  error: Exception | None) -> None:
+            CALL_LATENCY.observe(time.perf_counter() - start,
+                                 component=component, call=call, mode=mode)
+            CALL_IN_FLIGHT.dec(component=component, call=call, mode=mode)
+            if error is not None:
+                CALL_ERRORS.inc(component=component, call=call, mode=mode,
+                                error=type(error).__name__)
+            tracing.end_span(span, error)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                mode, start, span = before()
+                error: Exception | None = None
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    after(mode, start, span, error)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            mode, start, span = before()
+            error: Exception | None = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                after(mode, start, span, error)
+        return wrapper
+    return decorator
+
+
+def record_tokens(usage: Any) -> None:
+    """
+    Учитывает токены из поля usage ответа модели.
+
+    Args:
+        usage (Any): Объект usage из ответа OpenAI (может быть None).
+    """
+    if usage is None:
+        return
+    mode: str = current_mode.get()
+    GPT_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0,
+                   mode=mode, kind='prompt')
+    GPT_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0,
+                   mode=mode, kind='completion')
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Отдаёт содержимое реестра метрик по GET /metrics."""
+
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body: bytes = REGISTRY.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Не засоряем лог бота запросами скрейпера
+        pass
+
+
+def start_metrics_server(port: int,
+                         host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Запускает HTTP-эндпоинт /metrics в фоновом потоке.
+
+    Args:
+        port (int): Порт эндпоинта.
+        host (str): Адрес, на котором слушает эндпоинт.
+
+    Returns:
+        ThreadingHTTPServer: Запущенный сервер.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Iterator
+
+from openai import OpenAI
+
+from constants import (NEW_WORD_MESSAGE, QUIZ_BUTTONS, QUIZ_MESSAGE,
+                       RANDOM_MESSAGE)
+from content_store import ContentStoreWriter
+from gpt import GPT_MODEL, MAX_TOKENS, TEMPERATURE, ChatGptService
+from util import load_prompt
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+CONTENT_DIR = os.environ.get('CONTENT_DIR', 'resources/content')
+
+# Пулы: имя пула -> (промпт, сообщение пользователя)
+POOLS: dict[str, tuple[str, str]] = {
+    RANDOM_MESSAGE: (RANDOM_MESSAGE, ''),
+    NEW_WORD_MESSAGE: (NEW_WORD_MESSAGE, ''),
+    **{topic: (QUIZ_MESSAGE, topic) for topic in QUIZ_BUTTONS},
+}
+
+# Конечные статусы задания Batch API
+BATCH_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def build_jobs(path: str, pools: list[str], count: int) -> int:
+    """
+    Записывает JSONL-файл заданий Batch API для пулов.
+
+    Args:
+        path (str): Путь к файлу заданий.
+        pools (list[str]): Имена пулов.
+        count (int): Число запросов на пул.
+
+    Returns:
+        int: Число записанных заданий.
+    """
+    jobs: int = 0
+    with open(path, 'w', encoding='utf8') as file:
+        for pool in pools:
+            prompt_name, message = POOLS[pool]
+            messages: list[dict[str, str]] = [
+                {'role': 'system', 'content': load_prompt(prompt_name)},
+                {'role': 'user', 'content': message},
+            ]
+            for index in range(count):
+                job: dict[str, Any] = {
+                    'custom_id': f'{pool}:{index}',
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {
+                        'model': GPT_MODEL,
+                        'messages': messages,
+                        'max_tokens': MAX_TOKENS,
+                        'temperature': TEMPERATURE,
+                    },
+                }
+                file.write(json.dumps(job, ensure_ascii=False) + '\n')
+                jobs += 1
+    return jobs
+
+
+def run_batch(client: OpenAI, path: str,
+              poll_interval: float) -> Iterator[dict[str, Any]]:
+    """
+    Отправляет файл заданий в Batch API, дожидается выполнения и
+    построчно читает результаты.
+
+    Args:
+        client (OpenAI): Клиент OpenAI.
+        path (str): Путь к файлу заданий.
+        poll_interval (float): Период опроса статуса в секундах.
+
+    Yields:
+        dict[str, Any]: Строка результата Batch API.
+    """
+    with open(path, 'rb') as file:
+        input_file = client.files.create(file=file, purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id,
+                                  endpoint='/v1/chat/completions',
+                                  completion_window='24h')
+    logger.info('Создано задание %s', batch.id)
+    while batch.status not in BATCH_FINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        logger.info('Задание %s: %s', batch.id, batch.status)
+    if batch.status != 'completed' or not batch.output_file_id:
+        raise RuntimeError(
+            f'Задание {batch.id} завершилось со статусом {batch.status}')
+    with client.files.with_streaming_response.content(
+            batch.output_file_id) as response:
+        for line in response.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def run_local(client: OpenAI, path: str) -> Iterator[dict[str, Any]]:
+    """
+    Локальная замена Batch API: выполняет задания по одному через
+    chat.completions и возвращает результаты в формате Batch API.
+
+    Args:
+        client (OpenAI): Клиент OpenAI.
+        path (str): Путь к файлу заданий.
+
+    Yields:
+        dict[str, Any]: Строка результата в формате Batch API.
+    """
+    with open(path, 'r', encoding='utf8') as file:
+        for line in file:
+            job: dict[str, Any] = json.loads(line)
+            try:
+                completion = client.chat.completions.create(**job['body'])
+                yield {'custom_id': job['custom_id'], 'error': None,
+                       'response': {'status_code': 200,
+                                    'body': completion.model_dump()}}
+            except Exception as e:
+                yield {'custom_id': job['custom_id'], 'response': None,
+                       'error': {'message': str(e)}}
+
+
+def store_results(results: Iterator[dict[str, Any]],
+                  writer: ContentStoreWriter) -> Counter:
+    """
+    Сохраняет ответы модели в пулы по мере поступления.
+
+    Args:
+        results (Iterator[dict[str, Any]]): Строки результата Batch API.
+        writer (ContentStoreWriter): Хранилище пулов.
+
+    Returns:
+        Counter: Число добавленных, повторных и ошибочных ответов.
+    """
+    stats: Counter = Counter()
+    for result in results:
+        pool: str = result['custom_id'].rsplit(':', 1)[0]
+        response: dict[str, Any] | None = result.get('response')
+        if result.get('error') or not response or (
+                response.get('status_code') != 200):
+            logger.error('Ошибка в задании %s: %s',
+                         result['custom_id'], result.get('error'))
+            stats['failed'] += 1
+            continue
+        content: str = (
+            response['body']['choices'][0]['message']['content'] or '')
+        stats['added' if writer.add(pool, content) else 'duplicates'] += 1
+    return stats
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Заранее генерирует факты, слова и вопросы квиза.')
+    parser.add_argument('--pools', nargs='+', choices=list(POOLS),
+                        default=list(POOLS), help='какие пулы заполнять')
+    parser.add_argument('--count', type=int, default=100,
+                        help='число запросов на пул')
+    parser.add_argument('--local', action='store_true',
+                        help='выполнить задания через chat.completions '
+                             'вместо Batch API')
+    parser.add_argument('--poll-interval', type=float, default=60,
+                        help='период опроса статуса задания, секунд')
+    parser.add_argument('--content-dir', default=CONTENT_DIR,
+                        help='каталог пулов')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    store = ContentStoreWriter(arguments.content_dir)
+    jobs_path: str = os.path.join(arguments.content_dir, 'batch_jobs.jsonl')
+    total: int = build_jobs(jobs_path, arguments.pools, arguments.count)
+    logger.info('Сформировано заданий: %s', total)
+    client: OpenAI = ChatGptService.get_instance().client
+    if arguments.local:
+        results = run_local(client, jobs_path)
+    else:
+        results = run_batch(client, jobs_path, arguments.poll_interval)
+    logger.info('Результат: %s', dict(store_results(results, store)))
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Collection
+
+from telegram import Update
+from telegram.ext import (Application, ContextTypes, ConversationHandler,
+                          TypeHandler)
+
+from menu_cache import MenuStateCache
+from metrics import PROCESS_MEMORY, RESIDENT_SESSIONS, SPILLED_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession:
+    """
+    Состояние пользователя между апдейтами. Используется вместо словаря
+    context.user_data.
+
+    Attributes:
+        person (str | None): Выбранная личность для разговора.
+        quiz_topic (str | None): Текущая тема квиза.
+        correct_answers (int): Число правильных ответов по теме квиза.
+        last_seen (float): Время последнего апдейта (time.monotonic()),
+        0 - сессия ещё не использовалась, inf - апдейт пользователя
+        обрабатывается.
+    """
+
+    __slots__ = ('person', 'quiz_topic', 'correct_answers', 'last_seen')
+
+    # Поля, которые сохраняются на диск при вытеснении
+    persistent_fields = ('person', 'quiz_topic', 'correct_answers')
+
+    def __init__(self) -> None:
+        self.person: str | None = None
+        self.quiz_topic: str | None = None
+        self.correct_answers: int = 0
+        self.last_seen: float = 0.0
+
+    def is_empty(self) -> bool:
+        """Нет ли в сессии данных, которые стоит сохранять."""
+        return (self.person is None and self.quiz_topic is None
+                and not self.correct_answers)
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Возвращает сохраняемые поля сессии.
+
+        Returns:
+            dict[str, Any]: Поля сессии.
+        """
+        return {field: getattr(self, field)
+                for field in self.persistent_fields}
+
+    def update(self, data: dict[str, Any]) -> None:
+        """
+        Восстанавливает поля сессии из словаря.
+
+        Args:
+            data (dict[str, Any]): Поля, сохранённые to_dict().
+        """
+        for field in self.persistent_fields:
+            if field in data:
+                setattr(self, field, data[field])
+
+
+CONTEXT_TYPES = ContextTypes(user_data=ChatSession)
+
+
+def process_resident_bytes() -> int:
+    """
+    Возвращает объём резидентной памяти процесса.
+
+    Returns:
+        int: Размер в байтах или 0, если он недоступен.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class SessionConversationHandler(ConversationHandler):
+    """
+    ConversationHandler, состояния которого вытесняются на диск и
+    восстанавливаются вместе с сессией пользователя. Ключ диалога
+    должен включать пользователя (per_user=True).
+
+    Attributes:
+        volatile_states (frozenset[object]): Состояния, которые не
+        восстанавливаются после перезапуска бота, потому что зависят от
+        контекста модели в памяти.
+    """
+
+    def __init__(self, *args: Any,
+                 volatile_states: Collection[object] = (),
+                 **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.volatile_states = frozenset(volatile_states)
+
+    @property
+    def resident(self) -> int:
+        """Число состояний диалогов в памяти."""
+        return len(self._conversations)
+
+    def pop_user_states(
+            self, user_ids: set[int]) -> dict[int, list[list[Any]]]:
+        """
+        Извлекает состояния диалогов пользователей.
+
+        Args:
+            user_ids (set[int]): Идентификаторы пользователей.
+
+        Returns:
+            dict[int, list[list[Any]]]: Пары [ключ диалога, состояние]
+            для каждого пользователя.
+        """
+        states: dict[int, list[list[Any]]] = {}
+        for key in list(self._conversations):
+            # Ключ: (чат, пользователь, сообщение) без отключённых частей
+            user_id: int = key[int(self.per_chat)]
+            if user_id in user_ids:
+                states.setdefault(user_id, []).append(
+                    [list(key), self._conversations.pop(key)])
+        return states
+
+    def restore_states(self, states: list[list[Any]],
+                       restarted: bool = False) -> None:
+        """
+        Возвращает состояния диалогов, извлечённые pop_user_states().
+
+        Args:
+            states (list[list[Any]]): Пары [ключ диалога, состояние].
+            restarted (bool): Вытеснены ли состояния до перезапуска бота
+            (тогда volatile_states пропускаются).
+        """
+        for key, state in states:
+            if restarted and state in self.volatile_states:
+                continue
+            self._conversations.setdefault(tuple(key), state)
+
+
+class SessionSweeper:
+    """
+    Вытесняет сессии неактивных пользователей на диск и возвращает их
+    при следующем апдейте. Вместе с сессией вытесняются состояния
+    диалогов пользователя и состояние меню его чатов, чтобы память
+    зависела от числа активных пользователей, а не от всех, кто
+    когда-либо писал боту.
+
+    Attributes:
+        directory (str): Каталог для вытесненных сессий.
+        ttl (float): Время бездействия в секундах, после которого сессия
+        вытесняется.
+        interval (float): Период проверки в секундах.
+        menu_cache (MenuStateCache | None): Кэш состояния меню чатов.
+    """
+
+    def __init__(self, directory: str, ttl: float, interval: float = 60.0,
+                 menu_cache: MenuStateCache | None = None) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.interval = interval
+        self.menu_cache = menu_cache
+        self._conversation: SessionConversationHandler | None = None
+        self._task: asyncio.Task | None = None
+        self._started_at: float = time.time()
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f'{user_id}.json')
+
+    async def touch(self, update: Update,
+                    context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Отмечает активность пользователя и при необходимости
+        восстанавливает его сессию с диска.
+
+        Args:
+            update (Update): Объект Update, содержащий информацию о
+            полученном сообщении.
+            context (ContextTypes.DEFAULT_TYPE): Контекст, содержащий
+            информацию о состоянии бота.
+        """
+        session: ChatSession | None = context.user_data
+        if session is None:
+            return
+        if not session.last_seen:
+            path: str = self._path(update.effective_user.id)
+            try:
+                with open(path, 'r', encoding='utf8') as file:
+                    data: dict[str, Any] = json.load(file)
+                # Контекст модели хранится только в памяти, поэтому после
+                # перезапуска восстанавливается лишь то, что от него не
+                # зависит: меню и состояния вне volatile_states
+                restarted: bool = (
+                    data.get('spilled_at', 0.0) < self._started_at)
+                if not restarted:
+                    session.update(data)
+                if self._conversation is not None:
+                    self._conversation.restore_states(
+                        data.get('conversations', []), restarted)
+                if self.menu_cache is not None:
+                    for chat_id, digest in data.get('menus', {}).items():
+                        self.menu_cache.remember(chat_id, digest)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.error('Не удалось восстановить сессию %s: %s',
+                             update.effective_user.id, str(e))
+        # Пока апдейт обрабатывается, сессия не вытесняется
+        session.last_seen = math.inf
+
+    async def release(self, update: Update,
+                      context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Отмечает окончание обработки апдейта пользователя.
+
+        Args:
+            update (Update): Объект Update, содержащий информацию о
+            полученном сообщении.
+            context (ContextTypes.DEFAULT_TYPE): Контекст, содержащий
+            информацию о состоянии бота.
+        """
+        session: ChatSession | None = context.user_data
+        if session is not None:
+            session.last_seen = time.monotonic()
+
+    def sweep(self, application: Application,
+              ttl: float | None = None) -> int:
+        """
+        Вытесняет сессии, неактивные дольше ttl.
+
+        Args:
+            application (Application): Приложение бота.
+            ttl (float | None): Время бездействия в секундах вместо
+            self.ttl (отрицательное - вытеснить все сессии).
+
+        Returns:
+            int: Число вытесненных сессий.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        deadline: float = math.inf if ttl < 0 else time.monotonic() - ttl
+        idle: list[int] = [
+            user_id for user_id, session in application.user_data.items()
+            if session.last_seen <= deadline]
+        conversations: dict[int, list[list[Any]]] = (
+            self._conversation.pop_user_states(set(idle))
+            if self._conversation is not None else {})
+        os.makedirs(self.directory, exist_ok=True)
+        for user_id in idle:
+            data: dict[str, Any] = application.user_data[user_id].to_dict()
+            data['spilled_at'] = time.time()
+            states: list[list[Any]] = conversations.get(user_id, [])
+            if states:
+                data['conversations'] = states
+            menus: dict[int, str] = self._pop_menus(
+                {user_id} | {key[0] for key, _ in states})
+            if menus:
+                data['menus'] = menus
+            if not application.user_data[user_id].is_empty() or (
+                    states or menus):
+                with open(self._path(user_id), 'w', encoding='utf8') as file:
+                    json.dump(data, file, ensure_ascii=False)
+                SPILLED_SESSIONS.inc()
+            application.drop_user_data(user_id)
+        RESIDENT_SESSIONS.set(len(application.user_data))
+        PROCESS_MEMORY.set(process_resident_bytes())
+        return len(idle)
+
+    def _pop_menus(self, chat_ids: set[int]) -> dict[int, str]:
+        if self.menu_cache is None:
+            return {}
+        menus: dict[int, str] = {}
+        for chat_id in chat_ids:
+            digest: str | None = self.menu_cache.forget(chat_id)
+            if digest is not None:
+                menus[chat_id] = digest
+        return menus
+
+    async def run(self, application: Application) -> None:
+        """
+        Периодически вызывает sweep() до остановки приложения.
+
+        Args:
+            application (Application): Приложение бота.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                evicted: int = self.sweep(application)
+                if evicted:
+                    logger.info('Вытеснено неактивных сессий: %s', evicted)
+            except Exception as e:
+                logger.error('Ошибка при вытеснении сессий: %s', str(e))
+
+    def register(self, application: Application,
+                 conversation: SessionConversationHandler | None = None
+                 ) -> None:
+        """
+        Добавляет в приложение обработчики активности, которые
+        выполняются раньше и позже остальных.
+
+        Args:
+            application (Application): Приложение бота.
+            conversation (SessionConversationHandler | None): Диалог,
+            состояния которого вытесняются вместе с сессиями.
+        """
+        self._conversation = conversation
+        application.add_handler(TypeHandler(Update, self.touch), group=-1)
+        application.add_handler(TypeHandler(Update, self.release), group=99)
+
+    async def post_init(self, application: Application) -> None:
+        """
+        Запускает фоновое вытеснение. Передаётся в
+        ApplicationBuilder.post_init().
+
+        Args:
+            application (Application): Приложение бота.
+        """
+        # Не application.create_task(): такие задачи ожидаются при
+        # остановке приложения, а цикл вытеснения бесконечный
+        self._task = asyncio.create_task(self.run(application))
+
+    async def post_stop(self, application: Application) -> None:
+        """
+        Останавливает фоновое вытеснение и сохраняет на диск все сессии,
+        чтобы они пережили перезапуск. Передаётся в
+        ApplicationBuilder.post_stop().
+
+        Args:
+            application (Application): Приложение бота.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.sweep(application, ttl=-1)
@@ -0,0 +1,57 @@
+import os
+
+from content_store import (DATA_SUFFIX, INDEX_RECORD, INDEX_SUFFIX,
+                           ContentPool, ContentStore, ContentStoreWriter)
+
+TEXTS = ['Первый факт.', 'Второй факт 🙂', 'Third fact\nв две строки']
+
+
+def test_round_trip(tmp_path):
+    """Записанные тексты читаются из пула без изменений."""
+    writer = ContentStoreWriter(str(tmp_path))
+    for text in TEXTS:
+        assert writer.add('random', text)
+
+    pool = ContentPool(str(tmp_path), 'random')
+    assert [pool[i] for i in range(len(pool))] == TEXTS
+    pool.close()
+
+    store = ContentStore(str(tmp_path))
+    store.load()
+    assert store.sizes() == {'random': len(TEXTS)}
+    assert store.choice('random') in TEXTS
+    assert store.choice('new_word') is None
+
+
+def test_deduplication(tmp_path):
+    """Повторы не записываются, в том числе после перезапуска."""
+    writer = ContentStoreWriter(str(tmp_path))
+    assert writer.add('random', 'Один  факт')
+    assert not writer.add('random', '  один факт\n')
+    assert not writer.add('random', '   ')
+
+    writer = ContentStoreWriter(str(tmp_path))
+    assert not writer.add('random', 'ОДИН ФАКТ')
+    assert writer.add('random', 'Другой факт')
+    assert writer.add('new_word', 'Один факт')
+
+    store = ContentStore(str(tmp_path))
+    store.load()
+    assert store.sizes() == {'random': 2, 'new_word': 1}
+
+
+def test_broken_pools_are_skipped(tmp_path):
+    """Повреждённые пулы пропускаются, остальные загружаются."""
+    writer = ContentStoreWriter(str(tmp_path))
+    writer.add('random', 'Факт')
+    writer.add('new_word', 'Слово')
+    os.remove(tmp_path / ('new_word' + DATA_SUFFIX))
+    with open(tmp_path / ('quiz_prog' + INDEX_SUFFIX), 'wb') as file:
+        file.write(INDEX_RECORD.pack(0, 10))
+    open(tmp_path / ('quiz_prog' + DATA_SUFFIX), 'wb').close()
+
+    store = ContentStore(str(tmp_path))
+    store.load()
+    assert store.sizes() == {'random': 1}
+    assert store.choice('random') == 'Факт'
+    assert store.choice('quiz_prog') is None
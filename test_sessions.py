@@ -0,0 +1,91 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.ext import ApplicationBuilder, CommandHandler
+
+from menu_cache import MenuStateCache
+from sessions import CONTEXT_TYPES, SessionConversationHandler, SessionSweeper
+
+USER_ID = 5
+GROUP_ID = -100
+PRIVATE_KEY = [USER_ID, USER_ID]
+GROUP_KEY = [GROUP_ID, USER_ID]
+MAIN, DIALOG = range(2)
+
+
+async def noop(update, context):
+    return MAIN
+
+
+def make_bot(tmp_path):
+    """Собирает приложение, диалог и вытеснитель во временном каталоге."""
+    application = (ApplicationBuilder()
+                   .token('123456:TEST')
+                   .context_types(CONTEXT_TYPES)
+                   .updater(None)
+                   .build())
+    conversation = SessionConversationHandler(
+        entry_points=[CommandHandler('start', noop)],
+        states={MAIN: [], DIALOG: []},
+        fallbacks=[],
+        volatile_states=(DIALOG,))
+    menu_cache = MenuStateCache(str(tmp_path / 'menu_cache.jsonl'))
+    sweeper = SessionSweeper(str(tmp_path / 'sessions'), ttl=60,
+                             menu_cache=menu_cache)
+    sweeper.register(application, conversation)
+    return application, conversation, menu_cache, sweeper
+
+
+def spill(application, conversation, menu_cache, sweeper):
+    """Заполняет сессию пользователя и вытесняет её на диск."""
+    session = application.user_data[USER_ID]
+    session.person = 'Tolkien'
+    session.quiz_topic = 'quiz_math'
+    session.correct_answers = 2
+    session.last_seen = time.monotonic()
+    conversation.restore_states([[PRIVATE_KEY, DIALOG], [GROUP_KEY, MAIN]])
+    menu_cache.remember(USER_ID, 'digest')
+
+    assert sweeper.sweep(application, ttl=-1) == 1
+    assert USER_ID not in application.user_data
+    assert conversation.resident == 0
+    assert not menu_cache.is_current(USER_ID, 'digest')
+
+
+def touch(application, sweeper):
+    """Отправляет апдейт пользователя в touch() и возвращает сессию."""
+    session = application.user_data[USER_ID]
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=USER_ID))
+    asyncio.run(sweeper.touch(update, SimpleNamespace(user_data=session)))
+    return session
+
+
+def test_restore_in_same_process(tmp_path):
+    """Сессия, состояния диалогов и меню возвращаются целиком."""
+    application, conversation, menu_cache, sweeper = make_bot(tmp_path)
+    spill(application, conversation, menu_cache, sweeper)
+
+    session = touch(application, sweeper)
+    assert session.to_dict() == {'person': 'Tolkien',
+                                 'quiz_topic': 'quiz_math',
+                                 'correct_answers': 2}
+    assert conversation.pop_user_states({USER_ID}) == {
+        USER_ID: [[PRIVATE_KEY, DIALOG], [GROUP_KEY, MAIN]]}
+    assert menu_cache.is_current(USER_ID, 'digest')
+    assert not (tmp_path / 'sessions' / f'{USER_ID}.json').exists()
+
+
+def test_restore_after_restart(tmp_path):
+    """После перезапуска теряется только то, что зависит от модели."""
+    application, conversation, menu_cache, sweeper = make_bot(tmp_path)
+    spill(application, conversation, menu_cache, sweeper)
+    time.sleep(0.01)
+
+    # Новый процесс: вытеснитель создан позже, чем сессия сохранена
+    application, conversation, menu_cache, sweeper = make_bot(tmp_path)
+    session = touch(application, sweeper)
+    assert session.is_empty()
+    assert conversation.pop_user_states({USER_ID}) == {
+        USER_ID: [[GROUP_KEY, MAIN]]}
+    assert menu_cache.is_current(USER_ID, 'digest')
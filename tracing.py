@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar, Token
+from logging.handlers import RotatingFileHandler
+from typing import Any
+
+# Имя сервиса в ресурсных атрибутах экспортируемых трейсов
+SERVICE_NAME = 'chat_gpt_bot'
+
+# Коды статуса спана в OTLP
+STATUS_UNSET, STATUS_ERROR = 0, 2
+
+# Тип спана INTERNAL в OTLP
+SPAN_KIND_INTERNAL = 1
+
+# Трейсинг выключен, пока не вызван configure_tracing()
+enabled: bool = False
+slow_threshold_ns: int = 0
+
+_current_span: ContextVar['Span | None'] = ContextVar(
+    '_current_span', default=None)
+_exporter = logging.getLogger('tracing')
+_exporter.propagate = False
+
+
+class Span:
+    """
+    Отрезок времени внутри обработки одного апдейта.
+
+    Attributes:
+        name (str): Имя операции.
+        trace_id (str): Идентификатор трейса (общий для дерева спанов).
+        span_id (str): Идентификатор спана.
+        parent_id (str): Идентификатор родительского спана или ''.
+        start_ns (int): Время начала в наносекундах Unix-времени.
+        end_ns (int): Время окончания в наносекундах Unix-времени.
+        attributes (dict[str, Any]): Атрибуты спана.
+        error (str): Имя исключения, если операция завершилась ошибкой.
+        finished (list[Span]): Завершённые спаны трейса (общий список).
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns',
+                 'end_ns', 'attributes', 'error', 'finished')
+
+    def __init__(self, name: str, parent: 'Span | None',
+                 attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = ''
+            self.finished = []
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.finished = parent.finished
+        self.attributes = attributes
+        self.error = ''
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+    def to_otlp(self) -> dict[str, Any]:
+        """
+        Преобразует спан в объект OTLP/JSON.
+
+        Returns:
+            dict[str, Any]: Спан в формате OTLP/JSON.
+        """
+        span: dict[str, Any] = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KIND_INTERNAL,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}}
+                for key, value in self.attributes.items()],
+            'status': {'code': STATUS_UNSET},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return span
+
+
+def configure_tracing(path: str, slow_ms: float,
+                      max_bytes: int = 10 * 1024 * 1024,
+                      backup_count: int = 5) -> None:
+    """
+    Включает трейсинг: апдейты дольше порога записываются в
+    ротируемый файл в формате OTLP/JSON (один запрос экспорта на строку).
+
+    Args:
+        path (str): Путь к файлу трейсов.
+        slow_ms (float): Порог длительности апдейта в миллисекундах.
+        max_bytes (int): Размер файла, после которого он ротируется.
+        backup_count (int): Число хранимых старых файлов.
+    """
+    global enabled, slow_threshold_ns
+    handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                  backupCount=backup_count, encoding='utf8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _exporter.handlers = [handler]
+    _exporter.setLevel(logging.INFO)
+    slow_threshold_ns = int(slow_ms * 1_000_000)
+    enabled = True
+
+
+def start_span(name: str, root: bool = False,
+               **attributes: Any) -> tuple[Span, Token] | None:
+    """
+    Открывает спан, вложенный в текущий.
+
+    Args:
+        name (str): Имя операции.
+        root (bool): Можно ли начать новый трейс, если текущего спана нет.
+        **attributes (Any): Атрибуты спана.
+
+    Returns:
+        tuple[Span, Token] | None: Дескриптор для end_span() или None,
+        если трейсинг выключен или спан не нужен.
+    """
+    if not enabled:
+        return None
+    parent: Span | None = _current_span.get()
+    if parent is None and not root:
+        return None
+    span = Span(name, parent, attributes)
+    return span, _current_span.set(span)
+
+
+def end_span(handle: tuple[Span, Token] | None,
+             error: BaseException | None = None) -> None:
+    """
+    Закрывает спан и, если это корень медленного трейса, экспортирует
+    всё дерево.
+
+    Args:
+        handle (tuple[Span, Token] | None): Результат start_span().
+        error (BaseException | None): Исключение, завершившее операцию.
+    """
+    if handle is None:
+        return
+    span, token = handle
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = type(error).__name__
+    _current_span.reset(token)
+    span.finished.append(span)
+    if not span.parent_id and span.end_ns - span.start_ns >= slow_threshold_ns:
+        _export(span.finished)
+
+
+def _export(spans: list[Span]) -> None:
+    """
+    Записывает спаны трейса одной строкой OTLP/JSON.
+
+    Args:
+        spans (list[Span]): Завершённые спаны трейса.
+    """
+    request: dict[str, Any] = {'resourceSpans': [{
+        'resource': {'attributes': [
+            {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [span.to_otlp() for span in spans],
+        }],
+    }]}
+    _exporter.info(json.dumps(request, ensure_ascii=False))
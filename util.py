@@ -1,9 +1,59 @@
+import os
+
 from telegram import (BotCommand, BotCommandScopeChat, InlineKeyboardButton,
-                      InlineKeyboardMarkup, MenuButtonCommands,
+                      InlineKeyboardMarkup, InputFile, MenuButtonCommands,
                       MenuButtonDefault, Message, Update)
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
+from menu_cache import MenuStateCache, commands_hash
+from metrics import track_call
+
+menu_cache = MenuStateCache(
+    os.environ.get('MENU_CACHE_FILE', 'menu_cache.jsonl'))
+
+# Каталог ресурсов и прочитанные из него файлы (путь -> содержимое)
+RESOURCES_DIR = 'resources'
+_resources: dict[str, str | bytes] = {}
+
+
+def read_resource(path: str, binary: bool = False) -> str | bytes:
+    """
+    Читает файл ресурса один раз и дальше отдаёт его из памяти.
+
+    Args:
+        path (str): Путь к файлу.
+        binary (bool): Читать ли файл как байты.
+
+    Returns:
+        str | bytes: Содержимое файла.
+    """
+    data: str | bytes | None = _resources.get(path)
+    if data is None:
+        if binary:
+            with open(path, 'rb') as file:
+                data = file.read()
+        else:
+            with open(path, 'r', encoding='utf8') as file:
+                data = file.read()
+        _resources[path] = data
+    return data
+
+
+def warm_resources() -> int:
+    """
+    Загружает в память все сообщения, промпты и изображения.
+
+    Returns:
+        int: Число загруженных файлов.
+    """
+    for folder in ('messages', 'prompts', 'images'):
+        directory: str = os.path.join(RESOURCES_DIR, folder)
+        for file_name in os.listdir(directory):
+            read_resource(f'{RESOURCES_DIR}/{folder}/{file_name}',
+                          binary=folder == 'images')
+    return len(_resources)
+
 
 def dialog_user_info_to_str(user_data: dict[str, str]) -> str:
     """
@@ -21,6 +71,7 @@ def dialog_user_info_to_str(user_data: dict[str, str]) -> str:
     return '\n'.join(map(lambda k, v: (mapper[k], v), user_data.items()))
 
 
+@track_call('util')
 async def send_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
                     text: str) -> Message:
     """
@@ -63,6 +114,7 @@ async def send_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
     )
 
 
+@track_call('util')
 async def send_html(update: Update, context: ContextTypes.DEFAULT_TYPE,
                     text: str) -> Message:
     """
@@ -94,6 +146,7 @@ async def send_html(update: Update, context: ContextTypes.DEFAULT_TYPE,
     )
 
 
+@track_call('util')
 async def send_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE,
                             text: str, buttons: dict[str, str]) -> Message:
     """
@@ -124,6 +177,22 @@ async def send_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE,
         message_thread_id=update.effective_message.message_thread_id)
 
 
+@track_call('util')
+async def edit_text(message: Message, text: str) -> Message:
+    """
+    Заменяет текст ранее отправленного сообщения.
+
+    Args:
+        message (Message): Сообщение, которое нужно изменить.
+        text (str): Новый текст сообщения.
+
+    Returns:
+        Message: Объект Message, представляющий изменённое сообщение.
+    """
+    return await message.edit_text(text)
+
+
+@track_call('util')
 async def send_image(update: Update, context: ContextTypes.DEFAULT_TYPE,
                      name: str) -> Message:
     """
@@ -139,15 +208,19 @@ async def send_image(update: Update, context: ContextTypes.DEFAULT_TYPE,
     Returns:
         Message: Объект Message, представляющий отправленное сообщение.
     """
-    with open(f'resources/images/{name}.jpg', 'rb') as image:
-        return await context.bot.send_photo(chat_id=update.effective_chat.id,
-                                            photo=image)
+    image = InputFile(
+        read_resource(f'resources/images/{name}.jpg', binary=True),
+        filename=f'{name}.jpg')
+    return await context.bot.send_photo(chat_id=update.effective_chat.id,
+                                        photo=image)
 
 
+@track_call('util')
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
                          commands: dict[str, str]) -> None:
     """
-    Отображает команду и главное меню.
+    Отображает команду и главное меню. Если в чате уже установлен тот
+    же набор команд, запросы к Bot API не выполняются.
 
     Args:
         update (Update): Объект Update, содержащий информацию о
@@ -157,14 +230,20 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
         commands (dict[str, str]): Словарь команд (ключ - команда,
         значение - описание).
     """
+    chat_id: int = update.effective_chat.id
+    digest: str = commands_hash(commands)
+    if menu_cache.is_current(chat_id, digest):
+        return
     command_list: list[BotCommand] = [BotCommand(
         key, value) for key, value in commands.items()]
     await context.bot.set_my_commands(command_list, scope=BotCommandScopeChat(
-        chat_id=update.effective_chat.id))
+        chat_id=chat_id))
     await context.bot.set_chat_menu_button(menu_button=MenuButtonCommands(),
-                                           chat_id=update.effective_chat.id)
+                                           chat_id=chat_id)
+    menu_cache.remember(chat_id, digest)
 
 
+@track_call('util')
 async def hide_main_menu(
         update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -176,12 +255,14 @@ async def hide_main_menu(
         context (ContextTypes.DEFAULT_TYPE): Контекст, содержащий
         информацию о состоянии бота.
     """
+    menu_cache.forget(update.effective_chat.id)
     await context.bot.delete_my_commands(
         scope=BotCommandScopeChat(chat_id=update.effective_chat.id))
     await context.bot.set_chat_menu_button(menu_button=MenuButtonDefault(),
                                            chat_id=update.effective_chat.id)
 
 
+@track_call('util')
 def load_message(name: str) -> str:
     """
     Загружает сообщение из папки /resources/messages/.
@@ -192,11 +273,10 @@ def load_message(name: str) -> str:
     Returns:
         str: Содержимое файла сообщения.
     """
-    with open("resources/messages/" + name + ".txt", "r",
-              encoding="utf8") as file:
-        return file.read()
+    return read_resource("resources/messages/" + name + ".txt")
 
 
+@track_call('util')
 def load_prompt(name: str) -> str:
     """
     Загружает промпт из папки /resources/prompts/.
@@ -207,11 +287,10 @@ def load_prompt(name: str) -> str:
     Returns:
         str: Содержимое файла промпта.
     """
-    with open("resources/prompts/" + name + ".txt", "r",
-              encoding="utf8") as file:
-        return file.read()
+    return read_resource("resources/prompts/" + name + ".txt")
 
 
+@track_call('util')
 async def default_callback_handler(update: Update,
                                    context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -229,6 +308,7 @@ async def default_callback_handler(update: Update,
         update, context, f'You have pressed button with {query} callback')
 
 
+@track_call('util')
 async def send_response(update: Update, context: ContextTypes.DEFAULT_TYPE,
                         image: str, text: str) -> Message:
     """